@@ -1,19 +1,35 @@
 import customtkinter as ctk
 import rtmidi
 import threading
+import queue
 import time
+import sys
+import logging
+import logging.handlers
 import os
 import json
+import re
+import types
 import ctypes
 import uuid
 import hashlib
+import hmac
 import tkinter.messagebox
 import tkinter.filedialog
 from ctypes import wintypes
+from dataclasses import dataclass
+from functools import cached_property, partial
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is used when it is not installed
+    orjson = None
 
 # Windows API structures and functions
 user32 = ctypes.windll.user32
 kernel32 = ctypes.windll.kernel32
+gdi32 = ctypes.windll.gdi32
 
 # Window enumeration callback
 EnumWindowsProc = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
@@ -29,26 +45,121 @@ class RECT(ctypes.Structure):
         ("bottom", wintypes.LONG)
     ]
 
+class MOUSEINPUT(ctypes.Structure):
+    _fields_ = [
+        ("dx", wintypes.LONG),
+        ("dy", wintypes.LONG),
+        ("mouseData", wintypes.DWORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", wintypes.WPARAM)  # ULONG_PTR
+    ]
+
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = [
+        ("wVk", wintypes.WORD),
+        ("wScan", wintypes.WORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", wintypes.WPARAM)  # ULONG_PTR
+    ]
+
+class _INPUT_UNION(ctypes.Union):
+    _fields_ = [("mi", MOUSEINPUT), ("ki", KEYBDINPUT)]
+
+class INPUT(ctypes.Structure):
+    _anonymous_ = ("u",)
+    _fields_ = [("type", wintypes.DWORD), ("u", _INPUT_UNION)]
+
+class MSLLHOOKSTRUCT(ctypes.Structure):
+    _fields_ = [
+        ("pt", POINT),
+        ("mouseData", wintypes.DWORD),
+        ("flags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", wintypes.WPARAM)  # ULONG_PTR
+    ]
+
+# Low-level mouse hook callback (LRESULT is pointer-sized, like LPARAM)
+LowLevelMouseProc = ctypes.WINFUNCTYPE(wintypes.LPARAM, ctypes.c_int, wintypes.WPARAM, wintypes.LPARAM)
+
+# WinEvent callback (hook, event, hwnd, idObject, idChild, idEventThread, dwmsEventTime)
+WinEventProc = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                  wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+
 # Windows API functions
 user32.GetCursorPos.argtypes = [ctypes.POINTER(POINT)]
 user32.SetCursorPos.argtypes = [wintypes.INT, wintypes.INT]
-user32.mouse_event.argtypes = [wintypes.DWORD, wintypes.DWORD, wintypes.DWORD, wintypes.DWORD, wintypes.ULONG]
 user32.GetWindowTextW.argtypes = [wintypes.HWND, wintypes.LPWSTR, wintypes.INT]
-user32.GetWindowTextLengthW.argtypes = [wintypes.HWND]
 user32.IsWindowVisible.argtypes = [wintypes.HWND]
 user32.GetWindowRect.argtypes = [wintypes.HWND, ctypes.POINTER(RECT)]
 user32.SetForegroundWindow.argtypes = [wintypes.HWND]
+user32.SetForegroundWindow.restype = wintypes.BOOL
+user32.SwitchToThisWindow.argtypes = [wintypes.HWND, wintypes.BOOL]
+user32.SwitchToThisWindow.restype = None
+user32.EnumWindows.argtypes = [EnumWindowsProc, wintypes.LPARAM]
 user32.ShowWindow.argtypes = [wintypes.HWND, wintypes.INT]
 user32.IsIconic.argtypes = [wintypes.HWND]
+user32.IsWindow.argtypes = [wintypes.HWND]
+user32.GetForegroundWindow.restype = wintypes.HWND
 user32.GetAsyncKeyState.argtypes = [wintypes.INT]
 user32.PostMessageW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
-user32.keybd_event.argtypes = [wintypes.BYTE, wintypes.BYTE, wintypes.DWORD, wintypes.ULONG]
+user32.SendInput.argtypes = [wintypes.UINT, ctypes.POINTER(INPUT), ctypes.c_int]
+user32.SendInput.restype = wintypes.UINT
+user32.GetSystemMetrics.argtypes = [ctypes.c_int]
+user32.SetWindowsHookExW.argtypes = [ctypes.c_int, LowLevelMouseProc, wintypes.HINSTANCE, wintypes.DWORD]
+user32.SetWindowsHookExW.restype = wintypes.HHOOK
+user32.CallNextHookEx.argtypes = [wintypes.HHOOK, ctypes.c_int, wintypes.WPARAM, wintypes.LPARAM]
+user32.CallNextHookEx.restype = wintypes.LPARAM
+user32.UnhookWindowsHookEx.argtypes = [wintypes.HHOOK]
+user32.GetMessageW.argtypes = [ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT]
+user32.GetMessageW.restype = wintypes.BOOL
+user32.TranslateMessage.argtypes = [ctypes.POINTER(wintypes.MSG)]
+user32.DispatchMessageW.argtypes = [ctypes.POINTER(wintypes.MSG)]
+user32.PostQuitMessage.argtypes = [ctypes.c_int]
+user32.PeekMessageW.argtypes = [ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT, wintypes.UINT]
+user32.PeekMessageW.restype = wintypes.BOOL
+user32.MsgWaitForMultipleObjects.argtypes = [wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE), wintypes.BOOL, wintypes.DWORD, wintypes.DWORD]
+user32.MsgWaitForMultipleObjects.restype = wintypes.DWORD
+user32.SetWinEventHook.argtypes = [wintypes.DWORD, wintypes.DWORD, wintypes.HMODULE, WinEventProc, wintypes.DWORD, wintypes.DWORD, wintypes.DWORD]
+user32.SetWinEventHook.restype = wintypes.HANDLE
+user32.UnhookWinEvent.argtypes = [wintypes.HANDLE]
+kernel32.GetModuleHandleW.argtypes = [wintypes.LPCWSTR]
+kernel32.GetModuleHandleW.restype = wintypes.HMODULE
+user32.GetDC.argtypes = [wintypes.HWND]
+user32.GetDC.restype = wintypes.HDC
+user32.ReleaseDC.argtypes = [wintypes.HWND, wintypes.HDC]
+gdi32.GetPixel.argtypes = [wintypes.HDC, ctypes.c_int, ctypes.c_int]
+gdi32.GetPixel.restype = wintypes.DWORD  # COLORREF 0x00BBGGRR
+user32.GetWindowThreadProcessId.argtypes = [wintypes.HWND, ctypes.POINTER(wintypes.DWORD)]
+user32.GetWindowThreadProcessId.restype = wintypes.DWORD
 
 # Mouse event constants
+INPUT_MOUSE = 0
+MOUSEEVENTF_MOVE = 0x0001
 MOUSEEVENTF_LEFTDOWN = 0x0002
 MOUSEEVENTF_LEFTUP = 0x0004
+MOUSEEVENTF_VIRTUALDESK = 0x4000
+MOUSEEVENTF_ABSOLUTE = 0x8000
+
+# GetSystemMetrics: virtual desktop (all monitors) bounds
+SM_XVIRTUALSCREEN = 76
+SM_YVIRTUALSCREEN = 77
+SM_CXVIRTUALSCREEN = 78
+SM_CYVIRTUALSCREEN = 79
+
+# Reusable SendInput batch for WindowsHelper.click: absolute move, left down, left up
+_CLICK_INPUTS = (INPUT * 3)()
+for _inp in _CLICK_INPUTS:
+    _inp.type = INPUT_MOUSE
+_CLICK_INPUTS[0].mi.dwFlags = MOUSEEVENTF_MOVE | MOUSEEVENTF_ABSOLUTE | MOUSEEVENTF_VIRTUALDESK
+_CLICK_INPUTS[1].mi.dwFlags = MOUSEEVENTF_LEFTDOWN
+_CLICK_INPUTS[2].mi.dwFlags = MOUSEEVENTF_LEFTUP
+_INPUT_SIZE = ctypes.sizeof(INPUT)
+_click_lock = threading.Lock()
 
 # Keyboard constants
+INPUT_KEYBOARD = 1
 VK_CONTROL = 0x11
 VK_Q = 0x51
 VK_N = 0x4E
@@ -57,15 +168,54 @@ KEYEVENTF_KEYUP = 0x0002
 
 # Window messages
 WM_CLOSE = 0x0010
+WM_LBUTTONDOWN = 0x0201
 WM_SYSCOMMAND = 0x0112
 SC_CLOSE = 0xF060
 
 # ShowWindow constants
 SW_RESTORE = 9
 
+# Back-to-back window lookups within this many seconds share one EnumWindows pass
+WINDOW_CACHE_TTL = 0.25
+TITLE_BUF_LEN = 512
+
+# GetPixel failure value
+CLR_INVALID = 0xFFFFFFFF
+
+# Minimum pause after a real window switch before synthetic input is sent to it
+ACTIVATE_SETTLE_MS = 150
+
+# Per-thread scratch buffers (window title reads)
+_tls = threading.local()
+
+# Hook constants
+WH_MOUSE_LL = 14
+HC_ACTION = 0
+EVENT_OBJECT_SHOW = 0x8002
+OBJID_WINDOW = 0
+WINEVENT_OUTOFCONTEXT = 0x0000
+PM_NOREMOVE = 0x0000
+QS_ALLINPUT = 0x04FF
+
+# Plugin windows driven by the tone automation (extend the alternation for new targets)
+AUTOKEY_TITLE_RE = re.compile(r"Auto-Key", re.IGNORECASE)
+
+@EnumWindowsProc
+def _collect_visible_windows(hwnd, lparam):
+    """EnumWindows callback: append (hwnd, title, casefolded title) to the list lparam points at"""
+    if user32.IsWindowVisible(hwnd):
+        window_title = WindowsHelper.get_window_title(hwnd)
+        if window_title:
+            out = ctypes.cast(lparam, ctypes.POINTER(ctypes.py_object)).contents.value
+            out.append((hwnd, window_title, window_title.casefold()))
+    return True
+
 class WindowsHelper:
     """Helper class for Windows API operations"""
 
+    # (monotonic time, windows) of the last EnumWindows pass
+    _enum_cache = None
+
     @staticmethod
     def get_cursor_pos():
         """Get current cursor position"""
@@ -78,24 +228,46 @@ class WindowsHelper:
         """Set cursor position"""
         user32.SetCursorPos(int(x), int(y))
 
+    @staticmethod
+    def restore_cursor_pos(pos, tolerance=4):
+        """Move the cursor back to pos unless it is already within tolerance (Manhattan px)"""
+        cur_x, cur_y = WindowsHelper.get_cursor_pos()
+        if abs(cur_x - pos[0]) + abs(cur_y - pos[1]) >= tolerance:
+            WindowsHelper.set_cursor_pos(pos[0], pos[1])
+
     @staticmethod
     def click(x, y):
-        """Click at position"""
-        WindowsHelper.set_cursor_pos(x, y)
-        time.sleep(0.05)
-        user32.mouse_event(MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
-        time.sleep(0.05)
-        user32.mouse_event(MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
+        """Move to position and left-click with one SendInput batch"""
+        vx = user32.GetSystemMetrics(SM_XVIRTUALSCREEN)
+        vy = user32.GetSystemMetrics(SM_YVIRTUALSCREEN)
+        vw = user32.GetSystemMetrics(SM_CXVIRTUALSCREEN) or 1
+        vh = user32.GetSystemMetrics(SM_CYVIRTUALSCREEN) or 1
+
+        with _click_lock:
+            move = _CLICK_INPUTS[0].mi
+            # Absolute coordinates are normalized to 0..65535 over the virtual desktop
+            move.dx = ((int(x) - vx) * 65536 + vw - 1) // vw
+            move.dy = ((int(y) - vy) * 65536 + vh - 1) // vh
+            user32.SendInput(3, _CLICK_INPUTS, _INPUT_SIZE)
+
+    @staticmethod
+    def send_keys(*events):
+        """Inject (vk, flags) key events in order with a single SendInput call"""
+        inputs = (INPUT * len(events))()
+        for inp, (vk, flags) in zip(inputs, events):
+            inp.type = INPUT_KEYBOARD
+            inp.ki.wVk = vk
+            inp.ki.dwFlags = flags
+        return user32.SendInput(len(events), inputs, _INPUT_SIZE)
 
     @staticmethod
     def get_window_title(hwnd):
-        """Get window title"""
-        length = user32.GetWindowTextLengthW(hwnd)
-        if length == 0:
-            return ""
-        buff = ctypes.create_unicode_buffer(length + 1)
-        user32.GetWindowTextW(hwnd, buff, length + 1)
-        return buff.value
+        """Get window title via a per-thread reusable buffer (titles are truncated at 511 chars)"""
+        buff = getattr(_tls, "title_buf", None)
+        if buff is None:
+            buff = _tls.title_buf = ctypes.create_unicode_buffer(TITLE_BUF_LEN)
+        n = user32.GetWindowTextW(hwnd, buff, TITLE_BUF_LEN)
+        return buff[:n]
 
     @staticmethod
     def get_window_rect(hwnd):
@@ -111,39 +283,179 @@ class WindowsHelper:
             'height': rect.bottom - rect.top
         }
 
+    @staticmethod
+    def get_window_bounds(hwnd):
+        """Get window (left, top, width, height) with a single GetWindowRect"""
+        rect = RECT()
+        user32.GetWindowRect(hwnd, ctypes.byref(rect))
+        return rect.left, rect.top, rect.right - rect.left, rect.bottom - rect.top
+
+    @staticmethod
+    def get_pixel(x, y):
+        """Screen colour at (x, y) as (r, g, b), or None if it cannot be read"""
+        hdc = user32.GetDC(None)
+        if not hdc:
+            return None
+        try:
+            c = gdi32.GetPixel(hdc, x, y)
+        finally:
+            user32.ReleaseDC(None, hdc)
+        if c == CLR_INVALID:
+            return None
+        return c & 0xFF, (c >> 8) & 0xFF, (c >> 16) & 0xFF
+
+    @staticmethod
+    def _all_visible_windows():
+        """Visible titled top-level windows as (hwnd, title, casefolded title), cached for a short TTL"""
+        cached = WindowsHelper._enum_cache
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < WINDOW_CACHE_TTL:
+            return cached[1]
+
+        windows = []
+        # The output list travels through lparam so one callback serves every call/thread
+        ctx = ctypes.py_object(windows)
+        user32.EnumWindows(_collect_visible_windows, ctypes.addressof(ctx))
+        WindowsHelper._enum_cache = (now, windows)
+        return windows
+
     @staticmethod
     def find_windows_by_title(title_substring):
         """Find windows containing title substring"""
+        needle = title_substring.casefold()
         windows = []
+        for hwnd, window_title, folded in WindowsHelper._all_visible_windows():
+            if needle in folded:
+                # Geometry only for title matches
+                rect = WindowsHelper.get_window_rect(hwnd)
+                if rect['width'] > 50:  # Filter out tiny windows
+                    windows.append({'hwnd': hwnd, 'title': window_title, 'rect': rect})
+        return windows
 
-        def enum_callback(hwnd, lparam):
-            if user32.IsWindowVisible(hwnd):
-                window_title = WindowsHelper.get_window_title(hwnd)
-                if title_substring.lower() in window_title.lower():
-                    rect = WindowsHelper.get_window_rect(hwnd)
-                    if rect['width'] > 50:  # Filter out tiny windows
-                        windows.append({
-                            'hwnd': hwnd,
-                            'title': window_title,
-                            'rect': rect
-                        })
-            return True
+    @staticmethod
+    def title_matches(title, window_title, folded=None):
+        """True if window_title contains the substring title or matches the compiled regex title.
 
-        enum_proc = EnumWindowsProc(enum_callback)
-        user32.EnumWindows(enum_proc, 0)
-        return windows
+        folded is window_title.casefold() when the caller already has it (enumeration snapshot).
+        """
+        if isinstance(title, str):
+            if folded is None:
+                folded = window_title.casefold()
+            return title.casefold() in folded
+        return title.search(window_title) is not None
+
+    @staticmethod
+    def find_window(title):
+        """Find the first window whose title contains a substring or matches a compiled regex"""
+        for hwnd, window_title, folded in WindowsHelper._all_visible_windows():
+            if WindowsHelper.title_matches(title, window_title, folded):
+                rect = WindowsHelper.get_window_rect(hwnd)
+                if rect['width'] > 50:  # Filter out tiny windows
+                    return {'hwnd': hwnd, 'title': window_title, 'rect': rect}
+        return None
 
     @staticmethod
     def activate_window(hwnd):
-        """Activate and bring window to foreground"""
+        """Activate and bring window to foreground; returns False if it already was"""
+        if user32.GetForegroundWindow() == hwnd:
+            return False
         if user32.IsIconic(hwnd):
             user32.ShowWindow(hwnd, SW_RESTORE)
-        user32.SetForegroundWindow(hwnd)
-        user32.SwitchToThisWindow(hwnd, True)
+        # SwitchToThisWindow only when the foreground lock refused the switch
+        if not user32.SetForegroundWindow(hwnd):
+            user32.SwitchToThisWindow(hwnd, True)
+        # Restoring a window can show its owned windows; don't serve them from a stale snapshot
+        WindowsHelper._enum_cache = None
+        return True
+
+    @staticmethod
+    def wait_for_foreground(hwnd, timeout_ms, settle_ms=ACTIVATE_SETTLE_MS):
+        """Poll until hwnd is the restored foreground window, at most timeout_ms; returns whether it got there.
+
+        Foreground is reported as soon as SetForegroundWindow succeeds, before a restored
+        window has finished drawing, so at least settle_ms always pass before returning.
+        """
+        start = time.monotonic()
+        deadline = start + timeout_ms / 1000
+        ok = False
+        while True:
+            if user32.GetForegroundWindow() == hwnd and not user32.IsIconic(hwnd):
+                ok = True
+                break
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+        remaining = start + settle_ms / 1000 - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return ok
 
     @staticmethod
     def wait_for_left_click():
-        """Wait for left mouse button click"""
+        """Wait for left mouse button click via a low-level mouse hook"""
+        clicked = []
+
+        def hook_proc(n_code, w_param, l_param):
+            if n_code == HC_ACTION and w_param == WM_LBUTTONDOWN and not clicked:
+                info = ctypes.cast(l_param, ctypes.POINTER(MSLLHOOKSTRUCT)).contents
+                clicked.append((info.pt.x, info.pt.y))
+                user32.PostQuitMessage(0)
+            return user32.CallNextHookEx(None, n_code, w_param, l_param)
+
+        # The hook is called on this thread while it sits in GetMessageW
+        proc = LowLevelMouseProc(hook_proc)
+        hook = user32.SetWindowsHookExW(WH_MOUSE_LL, proc, kernel32.GetModuleHandleW(None), 0)
+        if not hook:
+            return WindowsHelper._poll_left_click()
+        try:
+            msg = wintypes.MSG()
+            while user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+                user32.TranslateMessage(ctypes.byref(msg))
+                user32.DispatchMessageW(ctypes.byref(msg))
+        finally:
+            user32.UnhookWindowsHookEx(hook)
+        return clicked[0] if clicked else WindowsHelper.get_cursor_pos()
+
+    @staticmethod
+    def wait_for_window_shown(pid, accept, timeout, before_wait=None):
+        """Wait until process pid shows a window for which accept(hwnd) is true; returns the HWND or None.
+
+        The WinEvent hook is installed before before_wait() runs, so a window shown in
+        response to it cannot be missed. Returns False (not None) if the hook is unavailable.
+        """
+        found = []
+
+        def on_show(hook, event, hwnd, id_object, id_child, thread_id, event_time):
+            if id_object == OBJID_WINDOW and id_child == 0 and hwnd and not found and accept(hwnd):
+                found.append(hwnd)
+
+        proc = WinEventProc(on_show)
+        hook = user32.SetWinEventHook(EVENT_OBJECT_SHOW, EVENT_OBJECT_SHOW, None, proc,
+                                      pid, 0, WINEVENT_OUTOFCONTEXT)
+        if not hook:
+            if before_wait:
+                before_wait()
+            return False
+        try:
+            if before_wait:
+                before_wait()
+            # Out-of-context events are delivered while this thread checks its queue;
+            # PM_NOREMOVE leaves the caller's (Tk's) own posted messages alone
+            msg = wintypes.MSG()
+            deadline = time.monotonic() + timeout
+            while not found:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                user32.MsgWaitForMultipleObjects(0, None, False, int(remaining * 1000), QS_ALLINPUT)
+                user32.PeekMessageW(ctypes.byref(msg), None, 0, 0, PM_NOREMOVE)
+        finally:
+            user32.UnhookWinEvent(hook)
+        return found[0] if found else None
+
+    @staticmethod
+    def _poll_left_click():
+        """Fallback for wait_for_left_click when the hook cannot be installed"""
         VK_LBUTTON = 0x01
 
         # Wait for button release
@@ -156,6 +468,28 @@ class WindowsHelper:
                 return WindowsHelper.get_cursor_pos()
             time.sleep(0.01)
 
+def _json_loads(raw):
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def _json_dumps(data):
+    """Pretty-printed JSON as bytes"""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=4).encode("utf-8")
+
+def _try_read(path):
+    """Read a whole file as bytes, or return None if it does not exist"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+LICENSE_KEY = "HAU_SETUP_STUDIO_2025"
+# Token = md5("<key>|<hwid>"); both parts are fixed for the process lifetime
+_KEY_PREFIX = f"{LICENSE_KEY}|".encode()
+_HWID_BYTES = str(uuid.getnode()).encode()
+
 MIDI_PORT_CHECK = "loopMIDI"
 CHANNEL = 0
 
@@ -168,12 +502,30 @@ CC_MAP = {
     "EXTRA_KNOB_1": 45, "EXTRA_KNOB_2": 46, "EXTRA_KNOB_3": 47, "EXTRA_KNOB_4": 48, "EXTRA_KNOB_5": 49
 }
 
+# Per-channel slack when matching the Auto-Key "done" pixel colour
+DONE_COLOR_TOLERANCE = 24
+
+# Seconds after DÒ TONE starts during which another press is not treated as cancel
+TONE_CANCEL_GRACE = 0.5
+
+# Semitones (-12..+12) to CC steps around the centre value 64
+TONE_SCALE = 63.5 / 12
+
+# Attribute access for fixed keys: CC.DO_TONE instead of CC_MAP.get("DO_TONE")
+CC = types.SimpleNamespace(**CC_MAP)
+
+log = logging.getLogger("controller_gui")
+
 class MidiHandler:
     def __init__(self):
         self.midiout = rtmidi.MidiOut()
         self.port_name = None
         self.is_connected = False
         self.last_sent = {}
+        # Single writer thread: callers enqueue and never block on the port
+        self._mq = queue.SimpleQueue()
+        self._pump_thread = threading.Thread(target=self._pump, daemon=True)
+        self._pump_thread.start()
         self.connect()
 
     def connect(self):
@@ -182,23 +534,73 @@ class MidiHandler:
             if MIDI_PORT_CHECK in name:
                 self.midiout.open_port(i)
                 self.port_name = name
+                self._send = self.midiout.send_message
                 self.is_connected = True
                 print(f"Connected to {name}")
                 return True
         print(f"{MIDI_PORT_CHECK} not found!")
         return False
 
-    def send_cc(self, cc, value):
-        if self.is_connected and cc is not None:
-            c = int(cc)
-            val = max(0, min(127, int(value)))
-            if self.last_sent.get(c) == val:
+    def release(self, ccs):
+        """Send 0 to every CC in ccs whose last sent value is non-zero"""
+        for cc in ccs:
+            if self.last_sent.get(cc):
+                self.send_cc(cc, 0)
+
+    def _pump(self):
+        # Messages go out in enqueue order; None stops the thread
+        get = self._mq.get
+        while True:
+            msg = get()
+            if msg is None:
                 return
-            self.last_sent[c] = val
-            self.midiout.send_message([0xB0 | CHANNEL, c, val])
+            try:
+                self._send(msg)
+            except Exception as e:
+                # One failed write (e.g. loopMIDI port gone) must not kill the only writer
+                log.error("Lỗi gửi MIDI %s: %s", msg, e)
+
+    def close(self):
+        """Flush queued messages, then close the output port"""
+        self._mq.put(None)
+        self._pump_thread.join(timeout=1.0)
+        self.midiout.close_port()
+        self.is_connected = False
+
+    def send_cc(self, cc, value):
+        # cc is always an int from CC_MAP; only the value needs normalizing
+        if not self.is_connected or cc is None:
+            return
+        v = value if type(value) is int and 0 <= value <= 127 else max(0, min(127, int(value)))
+        if self.last_sent.get(cc) == v:
+            return
+        self.last_sent[cc] = v
+        self._mq.put((0xB0 | CHANNEL, cc, v))
 
 midi = MidiHandler()
 
+def _setup_logging():
+    """Log through a queue so worker threads never block on the console"""
+    log_q = queue.Queue(-1)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_q, handler)
+    listener.start()
+    log.addHandler(logging.handlers.QueueHandler(log_q))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    return listener
+
+_log_listener = _setup_logging()
+
+@dataclass
+class BtnEntry:
+    """Widget, toggle state, base color and CC of one button"""
+    widget: Optional[ctk.CTkButton] = None
+    state: bool = False
+    color: str = ""
+    cc: Optional[int] = None
+
 class App(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -212,6 +614,26 @@ class App(ctk.CTk):
         self.col_text_green = "#4caf50"
         self.col_text_yellow = "#fbc02d"
 
+        # Cubase / Auto-Key HWNDs, re-validated with IsWindow + title on each use
+        self._cached_hwnds = {'cubase': None, 'autokey': None}
+
+        # Wakes the 15s Listen wait early (DÒ TONE cancel, shutdown)
+        self.autokey_done_evt = threading.Event()
+        # Set by on_closing; in-flight automations stop before their next click
+        self._shutdown = threading.Event()
+
+        # One long-lived worker runs the Auto-Key automations in order
+        self._task_q = queue.Queue()
+        threading.Thread(target=self._task_worker, daemon=True).start()
+        # Held from button press until the automation's finally block
+        self._autokey_lock = threading.Lock()
+        # Key of the automation holding the lock; pressing DÒ TONE again while it runs cancels it
+        self._autokey_active = None
+        self._tone_cancel = threading.Event()
+        self._tone_started = 0.0
+        # Coordinate picker worker; at most one waits for a click at a time
+        self._picker_thread = None
+
         # LICENSE CHECK
         if self.validate_license():
             self.init_main_app()
@@ -219,23 +641,20 @@ class App(ctk.CTk):
             self.init_activation_screen()
 
     # --- LICENSE LOGIC ---
-    def get_hwid(self):
-        return str(uuid.getnode())
-
     def get_expected_key(self):
-        return "HAU_SETUP_STUDIO_2025"
+        return LICENSE_KEY
 
-    def generate_token(self):
-        raw = f"{self.get_expected_key()}|{self.get_hwid()}"
-        return hashlib.md5(raw.encode()).hexdigest()
+    @cached_property
+    def expected_token(self):
+        return hashlib.md5(_KEY_PREFIX + _HWID_BYTES, usedforsecurity=False).hexdigest()
 
     def validate_license(self):
-        if not os.path.exists("license.dat"): return False
         try:
-            with open("license.dat", "r") as f:
-                saved_token = f.read().strip()
-            return saved_token == self.generate_token()
-        except: return False
+            data = _try_read("license.dat")
+        except OSError:
+            return False
+        if data is None: return False
+        return hmac.compare_digest(data.strip(), self.expected_token.encode())
 
     def init_activation_screen(self):
         self.title("KÍCH HOẠT BẢN QUYỀN")
@@ -260,7 +679,7 @@ class App(ctk.CTk):
 
         if user_key == expected:
             try:
-                token = self.generate_token()
+                token = self.expected_token
                 with open("license.dat", "w") as f:
                     f.write(token)
 
@@ -286,12 +705,16 @@ class App(ctk.CTk):
         self.grid_columnconfigure(1, weight=2)
         self.grid_columnconfigure(2, weight=1)
 
-        self.btn_widgets = {}
-        self.btn_states = {}
-        self.btn_colors = {}
+        self.btns = {}
 
         self.slider_widgets = {}
         self.slider_labels = {}
+        self._tone_value = 0.0
+
+        # Slider motion is coalesced: only the latest value per CC/label is flushed
+        self._pending_cc = {}
+        self._pending_labels = {}
+        self._flush_scheduled = False
 
         # Auto-Key coordinates configuration
         self.autokey_coords = {
@@ -299,6 +722,11 @@ class App(ctk.CTk):
             "listen_y_offset": 0.32,
             "send_x_offset": 0.5,
             "send_y_from_bottom": 140,
+            # Optional "analysis finished" pixel: relative x/y like Listen plus a "#RRGGBB"
+            # colour; when set, the Listen phase ends as soon as that pixel shows the colour
+            "done_x_offset": None,
+            "done_y_offset": None,
+            "done_color": "",
             "cubase_project_path": ""
         }
 
@@ -306,18 +734,53 @@ class App(ctk.CTk):
         self.setup_center_panel()
         self.setup_right_panel()
 
-        self.load_settings()
-        self.load_autokey_coords()
+        # Cấu hình giọng Lofi: Tune 27, Flex 45, Vib 46, Human 47
+        # Setup preset Lofi: Retune 20 (Soft), Flex 0, Vib 0, Human 0
+        # Resolved to (slider, cc, value) once; knobs without a slider are skipped
+        lofi = [
+            ("TUNE", 20),           # Retune Speed (CC 27)
+            ("EXTRA_KNOB_1", 0),    # FlexTune (CC 45)
+            ("EXTRA_KNOB_2", 0),    # Natural Vibrato (CC 46)
+            ("EXTRA_KNOB_3", 0)     # Humanize (CC 47)
+        ]
+        self._preset_lofi = [(self.slider_widgets[p], CC_MAP[p], v) for p, v in lofi if p in self.slider_widgets]
+
+        # Defaults are usable right away; saved files are parsed off the Tk thread
+        self._apply_autokey_coords()
+        self._loaded_q = queue.Queue(maxsize=1)
+        threading.Thread(target=self._bg_load, daemon=True).start()
+        self.after(10, self._poll_loaded)
+
+    def _bg_load(self):
+        """Read and parse config.json / autokey_coords.json on a worker thread"""
+        self._loaded_q.put((self.load_settings_data(), self.load_autokey_coords_data()))
+
+    def _poll_loaded(self):
+        # Tk calls must stay on the main thread, so the result is picked up here
+        try:
+            settings, coords = self._loaded_q.get_nowait()
+        except queue.Empty:
+            self.after(10, self._poll_loaded)
+            return
+        if coords:
+            self.autokey_coords.update(coords)
+            print("Đã tải tọa độ Auto-Key từ autokey_coords.json")
+        self._apply_autokey_coords()
+        if settings:
+            self.apply_settings(settings)
         self.after(1000, self.open_saved_project)
 
     def open_saved_project(self):
         path = self.autokey_coords.get("cubase_project_path", "")
-        if path and os.path.exists(path):
-            try:
-                print(f"Opening Cubase project: {path}")
-                os.startfile(path)
-            except Exception as e:
-                print(f"Error opening project: {e}")
+        if not path:
+            return
+        try:
+            os.startfile(path)
+            print(f"Opening Cubase project: {path}")
+        except FileNotFoundError:
+            pass  # saved project was moved or deleted
+        except Exception as e:
+            print(f"Error opening project: {e}")
 
     def setup_left_panel(self):
         frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -336,13 +799,22 @@ class App(ctk.CTk):
         ]
 
         for i in range(1, 6):
-            self.btn_states[f"EXTRA_BTN_{i}"] = False
+            extra_key = f"EXTRA_BTN_{i}"
+            self.btns[extra_key] = BtnEntry(cc=CC_MAP.get(extra_key))
+
+        # Hover variants computed once per distinct color, not per button
+        hover = {color: self.adjust_color(color) for _, color, _ in btns}
 
         for i, (text, color, cc_key) in enumerate(btns):
-            self.btn_states[cc_key] = False
-            self.btn_colors[cc_key] = color
+            entry = BtnEntry(color=color, cc=CC_MAP.get(cc_key))
+            self.btns[cc_key] = entry
 
-            cmd = lambda k=cc_key: self.on_btn_toggle(k)
+            # Plain toggles go straight to the entry; keys with side effects
+            # (VANG_FX drives EXTRA_BTN_*, LOFI applies a preset) need the key
+            if cc_key in ("VANG_FX", "LOFI"):
+                cmd = partial(self.on_btn_toggle, cc_key)
+            else:
+                cmd = partial(self._toggle_fast, entry)
 
             if cc_key == "DO_TONE":
                 cmd = self.start_autokey
@@ -356,15 +828,21 @@ class App(ctk.CTk):
             btn = ctk.CTkButton(
                 frame, text=text, fg_color=color,
                 font=("Arial", 11, "bold"), height=28, width=75,
-                hover_color=self.adjust_color(color),
+                hover_color=hover[color],
                 command=cmd
             )
-            self.btn_widgets[cc_key] = btn
+            entry.widget = btn
 
             r = i // 2
             c = i % 2
             btn.grid(row=r, column=c, padx=3, pady=4, sticky="ew")
 
+        # (cc, widget, color) resolved once for the Auto-Key start/finish paths
+        self._autokey_ctx = {
+            key: (self.btns[key].cc, self.btns[key].widget, self.btns[key].color)
+            for key in ("DO_TONE", "LAY_TONE")
+        }
+
     def setup_center_panel(self):
         frame = ctk.CTkFrame(self, fg_color="transparent", border_width=1, border_color="#333")
         frame.grid(row=0, column=1, sticky="nsew", padx=2, pady=10)
@@ -384,7 +862,7 @@ class App(ctk.CTk):
             slider = ctk.CTkSlider(
                 frame, from_=0, to=127, number_of_steps=127,
                 progress_color=color, height=16,
-                command=lambda val, k=cc_key: self.on_slider_change(val, k)
+                command=partial(self.on_slider_change_for, cc_key)
             )
             slider.set(100)
             slider.grid(row=i, column=1, padx=2, pady=5, sticky="ew")
@@ -413,12 +891,12 @@ class App(ctk.CTk):
         tone_frame.pack(pady=2)
 
         ctk.CTkButton(tone_frame, text="TONE", fg_color=self.col_btn_green, width=50, height=24, font=("Arial", 11)).pack(side="left", padx=3)
-        ctk.CTkButton(tone_frame, text="-", width=30, height=24, fg_color="#333", command=lambda: self.on_btn_click("TONE_DOWN")).pack(side="left", padx=1)
+        ctk.CTkButton(tone_frame, text="-", width=30, height=24, fg_color="#333", command=partial(self.on_btn_click, "TONE_DOWN")).pack(side="left", padx=1)
 
         self.tone_val = ctk.CTkLabel(tone_frame, text="0.0", font=("Arial", 14, "bold"), width=40, text_color="#00e676")
         self.tone_val.pack(side="left", padx=3)
 
-        ctk.CTkButton(tone_frame, text="+", width=30, height=24, fg_color="#333", command=lambda: self.on_btn_click("TONE_UP")).pack(side="left", padx=1)
+        ctk.CTkButton(tone_frame, text="+", width=30, height=24, fg_color="#333", command=partial(self.on_btn_click, "TONE_UP")).pack(side="left", padx=1)
 
         tune_frame = ctk.CTkFrame(frame, fg_color="transparent")
         tune_frame.pack(pady=10, fill="x", padx=5)
@@ -427,7 +905,7 @@ class App(ctk.CTk):
 
         self.tune_slider = ctk.CTkSlider(tune_frame, from_=0, to=127, progress_color="#d32f2f", height=16)
         self.tune_slider.pack(side="left", padx=5, fill="x", expand=True)
-        self.tune_slider.configure(command=lambda v: self.on_slider_change(v, "TUNE"))
+        self.tune_slider.configure(command=partial(self.on_slider_change_for, "TUNE"))
         self.slider_widgets["TUNE"] = self.tune_slider
 
         # for i in range(1, 6):
@@ -443,116 +921,131 @@ class App(ctk.CTk):
         ctk.CTkLabel(frame, text="BẢNG ĐIỀU KHIỂN TIẾNG VIỆT", font=("Arial", 11, "bold"), text_color=self.col_text_yellow).pack(side="bottom", pady=2)
         ctk.CTkLabel(frame, text="Hậu Setup Live Studio", font=("Arial", 10, "bold"), text_color=self.col_text_green).pack(side="bottom", pady=2)
 
-    def adjust_color(self, hex_color, factor=0.8):
+    @staticmethod
+    def adjust_color(hex_color, factor=0.8):
         return hex_color
 
-    def on_btn_toggle(self, key):
-        cur_state = self.btn_states.get(key, False)
-        new_state = not cur_state
-        self.btn_states[key] = new_state
-
-        btn = self.btn_widgets.get(key)
-        orig_color = self.btn_colors.get(key)
+    def _toggle_fast(self, entry):
+        new_state = not entry.state
+        entry.state = new_state
 
+        btn = entry.widget
         if btn:
             if new_state:
                 btn.configure(fg_color="#F0F0F0", text_color="#000000")
             else:
-                btn.configure(fg_color=orig_color, text_color="#FFFFFF")
+                btn.configure(fg_color=entry.color, text_color="#FFFFFF")
 
-        cc = CC_MAP.get(key)
+        cc = entry.cc
         if cc:
             midi.send_cc(cc, 127)
-            self.after(50, lambda: midi.send_cc(cc, 0))
+            self.after(50, midi.send_cc, cc, 0)
+        return new_state
+
+    def on_btn_toggle(self, key):
+        entry = self.btns.get(key)
+        if entry is None:
+            return
+        new_state = self._toggle_fast(entry)
 
         if key == "VANG_FX":
             for i in range(1, 6):
                 extra_key = f"EXTRA_BTN_{i}"
-                if self.btn_states.get(extra_key) != new_state:
+                if self.btns[extra_key].state != new_state:
                     self.on_btn_toggle(extra_key)
 
         if key == "LOFI" and new_state:
-            # Cấu hình giọng Lofi: Tune 27, Flex 45, Vib 46, Human 47
-            # Setup preset Lofi: Retune 20 (Soft), Flex 0, Vib 0, Human 0
-            settings = [
-                ("TUNE", 20),           # Retune Speed (CC 27)
-                ("EXTRA_KNOB_1", 0),    # FlexTune (CC 45)
-                ("EXTRA_KNOB_2", 0),    # Natural Vibrato (CC 46)
-                ("EXTRA_KNOB_3", 0)     # Humanize (CC 47)
-            ]
-            for param, val in settings:
-                if param in self.slider_widgets:
-                    self.slider_widgets[param].set(val)
-                    self.on_slider_change(val, param)
+            for slider, cc, val in self._preset_lofi:
+                slider.set(val)
+                self._pending_cc.pop(cc, None)  # a queued drag value must not override the preset
+                midi.send_cc(cc, val)
 
     def on_btn_click(self, key):
         if key not in ["TONE_UP", "TONE_DOWN"]:
             cc = CC_MAP.get(key)
             if cc:
                 midi.send_cc(cc, 127)
-                self.after(50, lambda: midi.send_cc(cc, 0))
+                self.after(50, midi.send_cc, cc, 0)
 
-        btn = self.btn_widgets.get(key)
-        if btn:
-            orig = self.btn_colors.get(key, "#333")
+        entry = self.btns.get(key)
+        if entry and entry.widget:
+            btn = entry.widget
+            orig = entry.color or "#333"
             btn.configure(fg_color="#ffffff", text_color="black")
             self.after(150, lambda: btn.configure(fg_color=orig, text_color="white"))
 
-        if key == "TONE_UP":
-            try:
-                cur = float(self.tone_val.cget("text"))
-                new_val = min(12.0, cur + 1.0)
-                self.tone_val.configure(text=f"{new_val:.1f}")
-
-                midi_val = int(64 + new_val * (63.5/12))
-                midi_val = max(0, min(127, midi_val))
-                midi.send_cc(CC_MAP.get("TONE_VAL_SEND"), midi_val)
-            except: pass
-        elif key == "TONE_DOWN":
-            try:
-                cur = float(self.tone_val.cget("text"))
-                new_val = max(-12.0, cur - 1.0)
-                self.tone_val.configure(text=f"{new_val:.1f}")
-
-                midi_val = int(64 + new_val * (63.5/12))
-                midi_val = max(0, min(127, midi_val))
-                midi.send_cc(CC_MAP.get("TONE_VAL_SEND"), midi_val)
-            except: pass
+        if key == "TONE_UP" or key == "TONE_DOWN":
+            # Numeric tone lives on the instance; the label is display-only
+            if key == "TONE_UP":
+                self._tone_value = min(12.0, self._tone_value + 1.0)
+            else:
+                self._tone_value = max(-12.0, self._tone_value - 1.0)
+            self.tone_val.configure(text=f"{self._tone_value:.1f}")
+            # -12..+12 maps to 0..127, so no clamp is needed
+            midi.send_cc(CC.TONE_VAL_SEND, int(64 + self._tone_value * TONE_SCALE))
 
     def on_slider_change(self, value, key):
+        self.on_slider_change_for(key, value)
+
+    def on_slider_change_for(self, key, value):
+        """Slider callback with the key first, so partial(self.on_slider_change_for, key) fits Tk's one-arg command"""
         cc = CC_MAP.get(key)
         if cc:
-            midi.send_cc(cc, value)
+            self._pending_cc[cc] = value
 
         if key in self.slider_labels:
+            self._pending_labels[key] = value
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.after(8, self._flush_cc)
+
+    def _flush_cc(self):
+        self._flush_scheduled = False
+
+        pending, self._pending_cc = self._pending_cc, {}
+        for cc, value in pending.items():
+            midi.send_cc(cc, value)
+
+        labels, self._pending_labels = self._pending_labels, {}
+        for key, value in labels.items():
             percent = int((value / 127) * 100)
             self.slider_labels[key].configure(text=f"{percent}%")
 
     def save_settings(self):
-        btn = self.btn_widgets.get("SAVE")
-        if btn:
-            orig = self.btn_colors.get("SAVE", "#333")
+        entry = self.btns.get("SAVE")
+        if entry and entry.widget:
+            btn = entry.widget
+            orig = entry.color or "#333"
             btn.configure(fg_color="#ffffff", text_color="black")
             self.after(150, lambda: btn.configure(fg_color=orig, text_color="white"))
 
         data = {
-            "toggles": self.btn_states,
+            "toggles": {k: e.state for k, e in self.btns.items()},
             "sliders": {k: v.get() for k, v in self.slider_widgets.items()}
         }
         try:
-            with open("config.json", "w", encoding='utf-8') as f:
-                json.dump(data, f, indent=4)
+            with open("config.json", "wb") as f:
+                f.write(_json_dumps(data))
             print("Đã lưu cấu hình vào config.json")
         except Exception as e:
             print(f"Lỗi lưu file: {e}")
 
-    def load_settings(self):
-        if not os.path.exists("config.json"): return
+    def load_settings_data(self):
         try:
+            raw = _try_read("config.json")
+            if raw is None: return None
             print("Đang tải cấu hình...")
-            with open("config.json", "r", encoding='utf-8') as f:
-                data = json.load(f)
+            data = _json_loads(raw)
+            if not isinstance(data, dict):
+                raise ValueError("config.json không phải object JSON")
+            return data
+        except Exception as e:
+            print(f"Lỗi load config: {e}")
+            return None
 
+    def apply_settings(self, data):
+        try:
             sliders_data = data.get("sliders", {})
             for k, v in sliders_data.items():
                 if k in self.slider_widgets:
@@ -561,48 +1054,79 @@ class App(ctk.CTk):
 
             toggles_data = data.get("toggles", {})
             for k, v in toggles_data.items():
-                if k in self.btn_widgets and k not in ["DO_TONE", "SAVE"]:
-                    if self.btn_states.get(k, False) != v:
+                entry = self.btns.get(k)
+                if entry and entry.widget and k not in ["DO_TONE", "SAVE"]:
+                    if entry.state != v:
                          self.on_btn_toggle(k)
         except Exception as e:
             print(f"Lỗi load config: {e}")
 
-    def load_autokey_coords(self):
-        if not os.path.exists("autokey_coords.json"):
-            return
+    def load_autokey_coords_data(self):
         try:
-            with open("autokey_coords.json", "r", encoding='utf-8') as f:
-                saved_coords = json.load(f)
-                self.autokey_coords.update(saved_coords)
-            print("Đã tải tọa độ Auto-Key từ autokey_coords.json")
+            raw = _try_read("autokey_coords.json")
+            if raw is None:
+                return None
+            data = _json_loads(raw)
+            # Parsed off the Tk thread, so reject non-object files here rather than in _poll_loaded
+            if not isinstance(data, dict):
+                raise ValueError("autokey_coords.json không phải object JSON")
+            return data
         except Exception as e:
             print(f"Lỗi load tọa độ Auto-Key: {e}")
+            return None
+
+    def _apply_autokey_coords(self):
+        """Copy the click offsets into plain attributes read by the tone threads"""
+        c = self.autokey_coords
+        self._listen_xo = c["listen_x_offset"]
+        self._listen_yo = c["listen_y_offset"]
+        self._send_xo = c["send_x_offset"]
+        self._send_yfb = c["send_y_from_bottom"]
+        self._done_probe = None
+        xo, yo, color = c.get("done_x_offset"), c.get("done_y_offset"), c.get("done_color")
+        if color and xo is not None and yo is not None:
+            try:
+                rgb = tuple(int(color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4))
+                self._done_probe = (float(xo), float(yo), rgb)
+            except (TypeError, ValueError):
+                print(f"⚠️ done_color/done_*_offset không hợp lệ: {color!r}, bỏ qua")
 
     def save_autokey_coords(self):
         try:
-            with open("autokey_coords.json", "w", encoding='utf-8') as f:
-                json.dump(self.autokey_coords, f, indent=4)
+            with open("autokey_coords.json", "wb") as f:
+                f.write(_json_dumps(self.autokey_coords))
             print("Đã lưu tọa độ Auto-Key vào autokey_coords.json")
             return True
         except Exception as e:
             print(f"Lỗi lưu tọa độ Auto-Key: {e}")
             return False
 
+    def _get_cached_hwnd(self, key, title):
+        """Return the cached HWND for key, enumerating windows only when it is gone or retitled"""
+        hwnd = self._cached_hwnds.get(key)
+        if hwnd and user32.IsWindow(hwnd) and user32.IsWindowVisible(hwnd):
+            # HWNDs get recycled, so the title must still match too
+            if WindowsHelper.title_matches(title, WindowsHelper.get_window_title(hwnd)):
+                return hwnd
+
+        win = WindowsHelper.find_window(title)
+        hwnd = self._cached_hwnds[key] = win['hwnd'] if win else None
+        return hwnd
+
     def pick_coordinate(self, button_name, x_entry, y_entry, popup):
         try:
             print(f"\n🎯 Bắt đầu đo tọa độ nút {button_name}...")
 
             # Focus Cubase
             print("   Focus Cubase...")
-            cubase_wins = WindowsHelper.find_windows_by_title('Cubase')
-            if cubase_wins:
-                WindowsHelper.activate_window(cubase_wins[0]['hwnd'])
-                time.sleep(1.0)
+            cubase_hwnd = self._get_cached_hwnd('cubase', 'Cubase')
+            if cubase_hwnd and WindowsHelper.activate_window(cubase_hwnd):
+                time.sleep(0.3)
 
             # Find Auto-Key window
-            autokey_wins = WindowsHelper.find_windows_by_title('Auto-Key')
+            autokey_hwnd = self._get_cached_hwnd('autokey', AUTOKEY_TITLE_RE)
 
-            if not autokey_wins:
+            if not autokey_hwnd:
                 print("❌ Không tìm thấy cửa sổ Auto-Key!")
                 def show_err():
                     tkinter.messagebox.showerror(
@@ -616,10 +1140,9 @@ class App(ctk.CTk):
                 self.after(100, show_err)
                 return
 
-            target_win = autokey_wins[0]
-            WindowsHelper.activate_window(target_win['hwnd'])
+            WindowsHelper.activate_window(autokey_hwnd)
 
-            rect = target_win['rect']
+            rect = WindowsHelper.get_window_rect(autokey_hwnd)
             print(f"📍 Cửa sổ Auto-Key: {rect['width']}x{rect['height']} tại ({rect['left']}, {rect['top']})")
             print(f"👆 Hướng dẫn: Click CHUỘT TRÁI vào nút {button_name} trên màn hình ngay bây giờ!")
 
@@ -672,8 +1195,19 @@ class App(ctk.CTk):
                 popup.focus_force()
             self.after(100, restore_on_err)
 
+    def _start_picker(self, button_name, x_entry, y_entry, popup):
+        """Run pick_coordinate on a worker thread; ignored while a pick is already waiting for a click"""
+        if self._picker_thread and self._picker_thread.is_alive():
+            print("⏳ Đang đo tọa độ, bỏ qua.")
+            return
+        popup.withdraw()
+        self._picker_thread = threading.Thread(
+            target=self.pick_coordinate, args=(button_name, x_entry, y_entry, popup), daemon=True
+        )
+        self._picker_thread.start()
+
     def open_settings_popup(self):
-        btn = self.btn_widgets.get("SETTINGS")
+        btn = self.btns["SETTINGS"].widget
         orig_color = "#1f77b4"
         if btn:
             btn.configure(text="ĐANG MỞ...", fg_color="#F0F0F0", text_color="black")
@@ -725,8 +1259,7 @@ class App(ctk.CTk):
         listen_y_entry.grid(row=1, column=1, pady=8, padx=5)
 
         def pick_listen_coords(e=None):
-            popup.withdraw()
-            threading.Thread(target=lambda: self.pick_coordinate("LISTEN", listen_x_entry, listen_y_entry, popup), daemon=True).start()
+            self._start_picker("LISTEN", listen_x_entry, listen_y_entry, popup)
 
         listen_x_entry.bind("<Button-3>", pick_listen_coords)
         listen_y_entry.bind("<Button-3>", pick_listen_coords)
@@ -745,8 +1278,7 @@ class App(ctk.CTk):
         send_y_entry.grid(row=3, column=1, pady=8, padx=5)
 
         def pick_send_coords(e=None):
-            popup.withdraw()
-            threading.Thread(target=lambda: self.pick_coordinate("SEND", send_x_entry, send_y_entry, popup), daemon=True).start()
+            self._start_picker("SEND", send_x_entry, send_y_entry, popup)
 
         send_x_entry.bind("<Button-3>", pick_send_coords)
         send_y_entry.bind("<Button-3>", pick_send_coords)
@@ -790,6 +1322,7 @@ class App(ctk.CTk):
                 self.autokey_coords["send_x_offset"] = float(send_x_entry.get()) / 100
                 self.autokey_coords["send_y_from_bottom"] = int(send_y_entry.get())
                 self.autokey_coords["cubase_project_path"] = project_entry.get()
+                self._apply_autokey_coords()
 
                 if self.save_autokey_coords():
                     tkinter.messagebox.showinfo("Thành công", "Đã lưu tọa độ Auto-Key!")
@@ -819,120 +1352,201 @@ class App(ctk.CTk):
             command=on_close_popup
         ).pack(side="left", padx=10)
 
-    def start_autokey(self):
-        print("Bắt đầu Dò Tone...")
-        cc = CC_MAP.get("DO_TONE")
-        if cc: midi.send_cc(cc, 127)
-
-        btn = self.btn_widgets.get("DO_TONE")
-        if btn: btn.configure(text="ĐANG DÒ...", fg_color="#F0F0F0", text_color="black")
+    def _task_worker(self):
+        while True:
+            fn = self._task_q.get()
+            try:
+                fn()
+            except Exception as e:
+                print(f"Lỗi: {e}")
+            finally:
+                self._task_q.task_done()
 
-        threading.Thread(target=self.auto_detect_tone_thread, daemon=True).start()
+    def start_autokey(self):
+        if not self._autokey_lock.acquire(blocking=False):
+            # The second click of a double-click lands inside the grace window and is ignored
+            running_for = time.monotonic() - self._tone_started
+            if self._autokey_active == "DO_TONE" and running_for >= TONE_CANCEL_GRACE:
+                print("⛔ Hủy Dò Tone...")
+                self._tone_cancel.set()
+                self.autokey_done_evt.set()  # wake the Listen wait immediately
+            else:
+                print("⏳ Đang chạy tác vụ Auto-Key, bỏ qua.")
+            return
+        try:
+            self._autokey_active = "DO_TONE"
+            self._tone_started = time.monotonic()
+            # Cleared here, not before the click, so a cancel during the focus phase still wakes the wait
+            self._tone_cancel.clear()
+            self.autokey_done_evt.clear()
+            print("Bắt đầu Dò Tone...")
+            cc, btn, _ = self._autokey_ctx["DO_TONE"]
+            if cc: midi.send_cc(cc, 127)
+
+            # While running, the same button cancels the detection
+            if btn: btn.configure(text="⛔ HỦY DÒ", fg_color="#F0F0F0", text_color="black")
+
+            self._task_q.put(self.auto_detect_tone_thread)
+        except Exception:
+            # The worker's finally never runs for a task that was not queued
+            self._autokey_active = None
+            self._autokey_lock.release()
+            raise
 
     def auto_detect_tone_thread(self):
         try:
             original_pos = WindowsHelper.get_cursor_pos()
 
-            print("[1/3] Focus Cubase...")
-            cubase_wins = WindowsHelper.find_windows_by_title('Cubase')
-            if not cubase_wins:
-                print("❌ Không thấy Cubase! Hãy mở Cubase.")
+            log.info("[1/3] Focus Cubase...")
+            cubase_hwnd = self._get_cached_hwnd('cubase', 'Cubase')
+            if not cubase_hwnd:
+                log.error("❌ Không thấy Cubase! Hãy mở Cubase.")
                 return
 
-            WindowsHelper.activate_window(cubase_wins[0]['hwnd'])
-            time.sleep(0.3)
+            if WindowsHelper.activate_window(cubase_hwnd):
+                WindowsHelper.wait_for_foreground(cubase_hwnd, 300)
 
-            autokey_wins = WindowsHelper.find_windows_by_title('Auto-Key')
-            if not autokey_wins:
-                print("❌ Không thấy Plugin Auto-Key! Hãy mở Plugin lên màn hình.")
+            autokey_hwnd = self._get_cached_hwnd('autokey', AUTOKEY_TITLE_RE)
+            if not autokey_hwnd:
+                log.error("❌ Không thấy Plugin Auto-Key! Hãy mở Plugin lên màn hình.")
                 return
 
-            target_win = autokey_wins[0]
-            WindowsHelper.activate_window(target_win['hwnd'])
-            time.sleep(0.5)
+            if WindowsHelper.activate_window(autokey_hwnd):
+                WindowsHelper.wait_for_foreground(autokey_hwnd, 500)
+
+            # Re-read geometry after activation (a restored window may have moved)
+            L, T, W, H = WindowsHelper.get_window_bounds(autokey_hwnd)
+            listen_x = L + int(W * self._listen_xo)
+            listen_y = T + int(H * self._listen_yo)
+            send_x = L + int(W * self._send_xo)
+            send_y = T + H - self._send_yfb
 
-            rect = target_win['rect']
-            listen_x = rect['left'] + int(rect['width'] * self.autokey_coords["listen_x_offset"])
-            listen_y = rect['top'] + int(rect['height'] * self.autokey_coords["listen_y_offset"])
-            send_x = rect['left'] + int(rect['width'] * self.autokey_coords["send_x_offset"])
-            send_y = rect['top'] + rect['height'] - self.autokey_coords["send_y_from_bottom"]
+            if self._tone_cancel.is_set() or self._shutdown.is_set():
+                WindowsHelper.restore_cursor_pos(original_pos)
+                log.info("⛔ Đã hủy, không bấm Listen.")
+                return
 
-            print(f"Click Listen ({listen_x}, {listen_y})...")
+            log.info("Click Listen (%d, %d)...", listen_x, listen_y)
             WindowsHelper.click(listen_x, listen_y)
 
-            print("Đang nghe (15s)...")
-            time.sleep(15)
+            log.info("Đang nghe (tối đa 15s)...")
+            self._wait_listen_done(L, T, W, H)
+            if self._shutdown.is_set():
+                return
+            if self._tone_cancel.is_set():
+                WindowsHelper.restore_cursor_pos(original_pos)
+                log.info("⛔ Đã hủy, không bấm Send.")
+                return
 
-            print(f"Click Send ({send_x}, {send_y})...")
+            log.info("Click Send (%d, %d)...", send_x, send_y)
             WindowsHelper.click(send_x, send_y)
 
-            WindowsHelper.set_cursor_pos(original_pos[0], original_pos[1])
-            print("✅ Xong quy trình!")
+            WindowsHelper.restore_cursor_pos(original_pos)
+            log.info("✅ Xong quy trình!")
 
         except Exception as e:
-            print(f"Lỗi: {e}")
+            log.error("Lỗi: %s", e)
         finally:
-            cc = CC_MAP.get("DO_TONE")
-            if cc: midi.send_cc(cc, 0)
-
-            btn = self.btn_widgets.get("DO_TONE")
-            orig_col = self.btn_colors.get("DO_TONE", self.col_btn_purple)
-            if btn: btn.configure(text="DÒ TONE", fg_color=orig_col, text_color="white")
+            # CC 0 and the button reset go out before the release, so a new run started right
+            # after can't have its 127 deduped away or its label overwritten; the nested
+            # finally still releases if the widget update fails
+            try:
+                cc, btn, orig_col = self._autokey_ctx["DO_TONE"]
+                if cc: midi.send_cc(cc, 0)
+
+                if btn: self.after(0, partial(btn.configure, text="DÒ TONE", fg_color=orig_col, text_color="white"))
+            finally:
+                self._autokey_active = None
+                self._autokey_lock.release()
+
+    def _wait_listen_done(self, L, T, W, H, timeout=15.0):
+        """Block until Auto-Key shows the configured done colour, a cancel/shutdown, or timeout"""
+        probe = self._done_probe
+        if probe is None:
+            self.autokey_done_evt.wait(timeout=timeout)
+            return
+        xo, yo, (r, g, b) = probe
+        px, py = L + int(W * xo), T + int(H * yo)
+        deadline = time.monotonic() + timeout
+        # Each 50ms wait doubles as the cancel/shutdown check
+        while not self.autokey_done_evt.wait(0.05):
+            pixel = WindowsHelper.get_pixel(px, py)
+            if pixel and all(abs(a - e) <= DONE_COLOR_TOLERANCE for a, e in zip(pixel, (r, g, b))):
+                log.info("Auto-Key đã nghe xong.")
+                return
+            if time.monotonic() >= deadline:
+                return
 
     def start_lay_tone(self):
-        print("Bắt đầu Lấy Tone...")
-        cc = CC_MAP.get("LAY_TONE")
-        if cc: midi.send_cc(cc, 127)
+        if not self._autokey_lock.acquire(blocking=False):
+            print("⏳ Đang chạy tác vụ Auto-Key, bỏ qua.")
+            return
+        try:
+            self._autokey_active = "LAY_TONE"
+            print("Bắt đầu Lấy Tone...")
+            cc, btn, _ = self._autokey_ctx["LAY_TONE"]
+            if cc: midi.send_cc(cc, 127)
 
-        btn = self.btn_widgets.get("LAY_TONE")
-        if btn: btn.configure(text="ĐANG LẤY...", fg_color="#F0F0F0", text_color="black")
+            if btn: btn.configure(text="ĐANG LẤY...", fg_color="#F0F0F0", text_color="black")
 
-        threading.Thread(target=self.lay_tone_thread, daemon=True).start()
+            self._task_q.put(self.lay_tone_thread)
+        except Exception:
+            # The worker's finally never runs for a task that was not queued
+            self._autokey_active = None
+            self._autokey_lock.release()
+            raise
 
     def lay_tone_thread(self):
         try:
             original_pos = WindowsHelper.get_cursor_pos()
 
-            print("[1/3] Focus Cubase...")
-            cubase_wins = WindowsHelper.find_windows_by_title('Cubase')
-            if not cubase_wins:
-                print("❌ Không thấy Cubase! Hãy mở Cubase.")
+            log.info("[1/3] Focus Cubase...")
+            cubase_hwnd = self._get_cached_hwnd('cubase', 'Cubase')
+            if not cubase_hwnd:
+                log.error("❌ Không thấy Cubase! Hãy mở Cubase.")
                 return
 
-            WindowsHelper.activate_window(cubase_wins[0]['hwnd'])
-            time.sleep(0.1)
+            if WindowsHelper.activate_window(cubase_hwnd):
+                WindowsHelper.wait_for_foreground(cubase_hwnd, 100)
 
-            autokey_wins = WindowsHelper.find_windows_by_title('Auto-Key')
-            if not autokey_wins:
-                print("❌ Không thấy Plugin Auto-Key! Hãy mở Plugin lên màn hình.")
+            autokey_hwnd = self._get_cached_hwnd('autokey', AUTOKEY_TITLE_RE)
+            if not autokey_hwnd:
+                log.error("❌ Không thấy Plugin Auto-Key! Hãy mở Plugin lên màn hình.")
                 return
 
-            target_win = autokey_wins[0]
-            WindowsHelper.activate_window(target_win['hwnd'])
-            time.sleep(0.5)
+            if WindowsHelper.activate_window(autokey_hwnd):
+                WindowsHelper.wait_for_foreground(autokey_hwnd, 500)
 
-            rect = target_win['rect']
-            send_x = rect['left'] + int(rect['width'] * self.autokey_coords["send_x_offset"])
-            send_y = rect['top'] + rect['height'] - self.autokey_coords["send_y_from_bottom"]
+            # Re-read geometry after activation (a restored window may have moved)
+            L, T, W, H = WindowsHelper.get_window_bounds(autokey_hwnd)
+            send_x = L + int(W * self._send_xo)
+            send_y = T + H - self._send_yfb
 
-            print(f"Click Send ({send_x}, {send_y})...")
+            log.info("Click Send (%d, %d)...", send_x, send_y)
             WindowsHelper.click(send_x, send_y)
 
-            WindowsHelper.set_cursor_pos(original_pos[0], original_pos[1])
-            print("✅ Xong quy trình!")
+            WindowsHelper.restore_cursor_pos(original_pos)
+            log.info("✅ Xong quy trình!")
 
         except Exception as e:
-            print(f"Lỗi: {e}")
+            log.error("Lỗi: %s", e)
         finally:
-            cc = CC_MAP.get("LAY_TONE")
-            if cc: midi.send_cc(cc, 0)
+            # CC 0 and the button reset go out before the release, so a new run started right
+            # after can't have its 127 deduped away or its label overwritten; the nested
+            # finally still releases if the widget update fails
+            try:
+                cc, btn, orig_col = self._autokey_ctx["LAY_TONE"]
+                if cc: midi.send_cc(cc, 0)
 
-            btn = self.btn_widgets.get("LAY_TONE")
-            orig_col = self.btn_colors.get("LAY_TONE", self.col_btn_purple)
-            if btn: btn.configure(text="LẤY TONE", fg_color=orig_col, text_color="white")
+                if btn: self.after(0, partial(btn.configure, text="LẤY TONE", fg_color=orig_col, text_color="white"))
+            finally:
+                self._autokey_active = None
+                self._autokey_lock.release()
 
     def on_closing(self):
         print("\n🛑 Đang bắt đầu quy trình tắt Cubase...")
+        self._shutdown.set()
+        self.autokey_done_evt.set()
         try:
             # 1. Tìm tất cả cửa sổ liên quan đến Cubase
             all_wins = WindowsHelper.find_windows_by_title('Cubase')
@@ -954,56 +1568,71 @@ class App(ctk.CTk):
                 print(f"🚀 Đang gửi lệnh Ctrl+Q tới HWND: {main_hwnd}")
                 WindowsHelper.activate_window(main_hwnd)
                 time.sleep(0.5)
-                
-                # Giả lập Ctrl + Q
-                user32.keybd_event(VK_CONTROL, 0, 0, 0) # Ctrl down
-                user32.keybd_event(VK_Q, 0, 0, 0)       # Q down
-                time.sleep(0.05)
-                user32.keybd_event(VK_Q, 0, KEYEVENTF_KEYUP, 0) # Q up
-                user32.keybd_event(VK_CONTROL, 0, KEYEVENTF_KEYUP, 0) # Ctrl up
-
-                # 2. Đợi hộp thoại "Save" hiện lên
+
+                def send_ctrl_q():
+                    # Giả lập Ctrl + Q
+                    WindowsHelper.send_keys(
+                        (VK_CONTROL, 0), (VK_Q, 0),                             # Ctrl, Q down
+                        (VK_Q, KEYEVENTF_KEYUP), (VK_CONTROL, KEYEVENTF_KEYUP)  # Q, Ctrl up
+                    )
+
+                def is_save_dialog(hwnd):
+                    # Hộp thoại "Cubase..." thường có kích thước cố định và nhỏ
+                    if hwnd == main_hwnd or not user32.IsWindowVisible(hwnd):
+                        return False
+                    if 'cubase' not in WindowsHelper.get_window_title(hwnd).casefold():
+                        return False
+                    r = WindowsHelper.get_window_rect(hwnd)
+                    return 300 < r['width'] < 650 and 100 < r['height'] < 350
+
+                # 2. Đợi hộp thoại "Save" hiện lên (WinEvent hook, không cần quét liên tục)
                 print("⏳ Đang đợi hộp thoại xác nhận 'Save' (tối đa 5s)...")
-                found_dialog = False
-                for i in range(50):
-                    time.sleep(0.1)
-                    # Tìm cửa sổ có tiêu đề "Cubase Pro" hoặc "Cubase" mà không phải cửa sổ chính
-                    dialogs = WindowsHelper.find_windows_by_title('Cubase')
-                    for dlg in dialogs:
-                        # Hộp thoại thường có kích thước cố định và nhỏ
-                        w, h = dlg['rect']['width'], dlg['rect']['height']
-                        if dlg['hwnd'] != main_hwnd and 300 < w < 650 and 100 < h < 350:
-                            print(f"🎯 Đã phát hiện hộp thoại: '{dlg['title']}' ({w}x{h})")
-                            WindowsHelper.activate_window(dlg['hwnd'])
-                            time.sleep(0.5)
-                            
-                            # Tính toán vị trí nút "Don't Save" (nằm chính giữa hàng nút dưới cùng)
-                            click_x = dlg['rect']['left'] + (w // 2)
-                            click_y = dlg['rect']['top'] + h - 25 # Cách đáy khoảng 25 pixel
-                            
-                            print(f"🖱️ Click vào nút Don't Save tại ({click_x}, {click_y})")
-                            WindowsHelper.click(click_x, click_y)
-                            
-                            # Gửi thêm phím tắt cho chắc chắn (N hoặc D)
-                            for vk in [VK_N, VK_D]:
-                                user32.keybd_event(vk, 0, 0, 0) 
-                                time.sleep(0.05)
-                                user32.keybd_event(vk, 0, KEYEVENTF_KEYUP, 0)
-                                time.sleep(0.05)
-                            
-                            print("✅ Đã chọn 'Don't Save'")
-                            found_dialog = True
-                            time.sleep(0.05) # Đợi Cubase đóng hẳn
+                pid = wintypes.DWORD()
+                user32.GetWindowThreadProcessId(main_hwnd, ctypes.byref(pid))
+                dlg_hwnd = WindowsHelper.wait_for_window_shown(pid.value, is_save_dialog, 5.0, before_wait=send_ctrl_q)
+
+                if dlg_hwnd is False:
+                    # Không cài được hook: quét cửa sổ như cũ
+                    dlg_hwnd = None
+                    for i in range(50):
+                        time.sleep(0.1)
+                        dlg_hwnd = next((w['hwnd'] for w in WindowsHelper.find_windows_by_title('Cubase')
+                                         if is_save_dialog(w['hwnd'])), None)
+                        if dlg_hwnd:
                             break
-                    if found_dialog: break
-                
-                if not found_dialog:
+
+                if dlg_hwnd:
+                    rect = WindowsHelper.get_window_rect(dlg_hwnd)
+                    w, h = rect['width'], rect['height']
+                    print(f"🎯 Đã phát hiện hộp thoại: '{WindowsHelper.get_window_title(dlg_hwnd)}' ({w}x{h})")
+                    WindowsHelper.activate_window(dlg_hwnd)
+                    time.sleep(0.5)
+
+                    # Tính toán vị trí nút "Don't Save" (nằm chính giữa hàng nút dưới cùng)
+                    click_x = rect['left'] + (w // 2)
+                    click_y = rect['top'] + h - 25 # Cách đáy khoảng 25 pixel
+
+                    print(f"🖱️ Click vào nút Don't Save tại ({click_x}, {click_y})")
+                    WindowsHelper.click(click_x, click_y)
+
+                    # Gửi thêm phím tắt cho chắc chắn (N hoặc D)
+                    WindowsHelper.send_keys(
+                        (VK_N, 0), (VK_N, KEYEVENTF_KEYUP),
+                        (VK_D, 0), (VK_D, KEYEVENTF_KEYUP)
+                    )
+
+                    print("✅ Đã chọn 'Don't Save'")
+                    time.sleep(0.05) # Đợi Cubase đóng hẳn
+                else:
                     print("⚠️ Không thấy hộp thoại xác nhận xuất hiện. Có thể Cubase đã đóng luôn hoặc không có gì để lưu.")
 
         except Exception as e:
             print(f"❌ Lỗi khi đóng Cubase: {e}")
 
         print("👋 Đang đóng Tool...")
+        # Drop button CCs still latched at 127 so the next launch starts clean
+        midi.release([e.cc for e in getattr(self, "btns", {}).values() if e.cc])
+        midi.close()
         self.destroy()
         os._exit(0)
 